@@ -28,9 +28,9 @@
 #  event caused by the use of the program.                                     #
 ################################################################################
 
-from numpy import array, dot, zeros
+from numpy import array, dot, zeros, ones, arange, cumsum, repeat, add, bincount, isscalar, unique, concatenate, searchsorted, intp
 import scipy.linalg
-from scipy.sparse import coo_matrix
+from scipy.sparse import csr_matrix
 
 from pyfem.util.logger   import getLogger
 
@@ -49,8 +49,50 @@ class Constrainer:
     self.constrainedDofs = {}
     self.constrainedVals = {}
     self.constrainedFac  = {}
+
+    self.labelIndex      = {}
+    self.factors         = zeros( 0 )
+
+    self.invalidateFactor()
     
     
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def __getstate__( self ):
+
+    '''The factorization can not be pickled. It is recomputed in the next
+       call to DofSpace.solve.'''
+
+    state = self.__dict__.copy()
+
+    state['factorMatrix'] = None
+    state['factorKey']    = None
+    state['factorCols']   = None
+    state['factor']       = None
+
+    return state
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def clone( self ):
+
+    '''Returns a copy of the constraint administration. The constraints
+       matrix and the factorization are not copied; call flush() on the
+       copy before using it in a solve.'''
+
+    cons = Constrainer( self.nDofs , self.name )
+
+    cons.constrainData   = { dofID : list(items) for dofID,items in self.constrainData.items() }
+    cons.constrainedDofs = { label : list(dofs)  for label,dofs  in self.constrainedDofs.items() }
+    cons.constrainedVals = { label : list(vals)  for label,vals  in self.constrainedVals.items() }
+    cons.constrainedFac  = dict( self.constrainedFac )
+
+    return cons
+
 #-------------------------------------------------------------------------------
 #
 #-------------------------------------------------------------------------------
@@ -75,6 +117,33 @@ class Constrainer:
     
     self.constrainedVals[label].append( addVal )     
 
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def addConstraints( self , dofIDs , vals , label ):
+
+    '''Adds a batch of prescribed values to a single label. Unlike
+       addConstraint, the membership test is a dictionary lookup, so the
+       cost is linear in the number of dofs.'''
+
+    if isscalar( vals ):
+      vals = [ vals ] * len( dofIDs )
+
+    dofs  = self.constrainedDofs[label]
+    cvals = self.constrainedVals[label]
+    index = { dofID : i for i,dofID in enumerate( dofs ) }
+
+    for dofID,val in zip( dofIDs , vals ):
+      self.constrainData.setdefault( dofID , [] ).append( val )
+
+      if dofID in index:
+        cvals[index[dofID]] += val
+      else:
+        index[dofID] = len( dofs )
+        dofs.append ( dofID )
+        cvals.append( val )
+
 #-------------------------------------------------------------------------------
 #
 #-------------------------------------------------------------------------------
@@ -134,44 +203,116 @@ class Constrainer:
   
     '''Returns the constraints matrix using the class member arrays'''
     
-    row = []
-    col = [] 
-    val = [] 
     master = {}
 
-    iCon = 0
-
-    for iDof in range(self.nDofs):
-      if iDof in self.constrainData:
-        for item in self.constrainData[iDof]:
-          if type(item) is not list:
-            continue
+    for iDof in self.constrainData:
+      for item in self.constrainData[iDof]:
+        if type(item) is list:
+          if item[1][0] in self.constrainData:
+            #Something not checked correct in checkConstraint2
+            raise RuntimeError('ERROR - Master of slave is a slave itself')
           else:
-            if item[1][0] in self.constrainData:
-              #Something not checked correct in checkConstraint2
-              raise RuntimeError('ERROR - Master of slave is a slave itself')
-            else:
-              master[iDof] = item
-        
-      else:          
-        row.append(iDof)
-        col.append(iCon)
-        val.append(1.)
-
-        iCon+=1
-    
-    # Assign correct slaves to masters
-    for iSlave in master:
-      fac = master[iSlave][2]
-      masterDofID = master[iSlave][1][0]
-
-      #Find column for free DOF of the Master
-      rowID = row.index(masterDofID)
-      col.append(rowID)
-      row.append(iSlave)
-      val.append(fac)
-          
-    self.C = coo_matrix((val,(row,col)), shape=(self.nDofs,iCon))
+            master[iDof] = item
+
+    # Free dofs are numbered consecutively; colIdx gives the column of each
+    # free dof in the constraints matrix
+
+    mask = ones( self.nDofs , dtype=bool )
+    mask[ array( list( self.constrainData.keys() ) , dtype=intp ) ] = False
+
+    free   = mask.nonzero()[0]
+    colIdx = cumsum( mask ) - 1
+    iCon   = len( free )
+
+    # Every row of C has at most one entry: a unit value in the column of a
+    # free dof, or the factor in the column of the master of a slave.
+    # Prescribed dofs have an empty row. The CSR arrays are therefore
+    # filled directly, without sorting triplets.
+
+    slaves = list( master.keys() )
+
+    col = zeros( self.nDofs , dtype=intp )
+    val = zeros( self.nDofs )
+
+    col[free] = arange( iCon )
+    val[free] = 1.
+
+    slaveIdx = array( slaves , dtype=intp )
+
+    col[slaveIdx] = colIdx[ array( [ master[iSlave][1][0] for iSlave in slaves ] , dtype=intp ) ]
+    val[slaveIdx] = array( [ master[iSlave][2] for iSlave in slaves ] , dtype=float )
+
+    hasEntry = mask.copy()
+    hasEntry[slaveIdx] = True
+
+    indptr = concatenate( [ zeros( 1 , dtype=intp ) , cumsum( hasEntry ) ] )
+
+    self.C  = csr_matrix((val[hasEntry],col[hasEntry],indptr), shape=(self.nDofs,iCon))
+    self.CT = self.C.transpose().tocsr()
+
+    self.freeIdx   = free
+    self.hasTyings = len( slaves ) > 0
+
+    self.invalidateFactor()
+
+    # Index arrays of the constrained dofs per label
+
+    self.constrainedIdx = { name : array( dofs , dtype=intp ) for name,dofs in self.constrainedDofs.items() }
+
+    # Load factors of all labels in a single array
+
+    self.labelIndex = { name : i for i,name in enumerate( self.constrainedDofs ) }
+    self.factors    = array( [ self.constrainedFac[name] for name in self.constrainedDofs ] , dtype=float )
+
+    # All constraints concatenated in a single set of arrays: the dof, its
+    # value, the index of its label and its position in the unique list
+    # of prescribed dofs
+
+    self.allDofs   = concatenate( [ zeros( 0 , dtype=intp ) ] + list( self.constrainedIdx.values() ) )
+    self.allVals   = concatenate( [ zeros( 0 ) ] + [ array( vals , dtype=float ) for vals in self.constrainedVals.values() ] )
+    self.allLabels = repeat( arange( len( self.labelIndex ) ) , [ len( dofs ) for dofs in self.constrainedIdx.values() ] )
+
+    self.prescribedIdx = unique( self.allDofs )
+    self.prescribedPos = searchsorted( self.prescribedIdx , self.allDofs )
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def renumber( self , newNumber ):
+
+    '''Maps all dof numbers in the constraints through newNumber, where
+       newNumber[i] is the new number of dof i. A constraints matrix that
+       was already built is rebuilt, which also discards the factorization.'''
+
+    def renumberItem( item ):
+      if type(item) is list and len(item) == 3:
+        return [ item[0] , newNumber[item[1]] , item[2] ]
+      return item
+
+    self.constrainData = { int(newNumber[dofID]) : [ renumberItem( item ) for item in items ]
+                           for dofID,items in self.constrainData.items() }
+
+    self.constrainedDofs = { label : newNumber[ array( dofs , dtype=intp ) ].tolist()
+                             for label,dofs in self.constrainedDofs.items() }
+
+    if hasattr( self , "C" ):
+      self.flush()
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def invalidateFactor( self ):
+
+    '''Discards the stored factorization of the constrained system. This is
+       only needed when a matrix that has been passed to DofSpace.solve with
+       reuseFactor is modified in place.'''
+
+    self.factorMatrix = None
+    self.factorKey    = None
+    self.factorCols   = None
+    self.factor       = None
 
 #-------------------------------------------------------------------------------
 #
@@ -179,8 +320,18 @@ class Constrainer:
 
   def addConstrainedValues( self , a ):
     
-    for name in self.constrainedDofs.keys():    
-      a[self.constrainedDofs[name]] += self.constrainedFac[name] * array(self.constrainedVals[name])
+    add.at( a , self.allDofs , self.factors[self.allLabels] * self.allVals )
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def getPrescribedValues( self ):
+
+    '''Returns the current values of the dofs in prescribedIdx'''
+
+    return bincount( self.prescribedPos , weights = self.factors[self.allLabels] * self.allVals ,
+                     minlength = len( self.prescribedIdx ) )
 
 #-------------------------------------------------------------------------------
 #
@@ -188,8 +339,7 @@ class Constrainer:
 
   def setConstrainedValues( self , a ):
   
-    for name in self.constrainedDofs.keys():             
-      a[self.constrainedDofs[name]] = self.constrainedFac[name] * array(self.constrainedVals[name])
+    a[self.allDofs] = self.factors[self.allLabels] * self.allVals
       
 #-------------------------------------------------------------------------------
 #
@@ -198,10 +348,12 @@ class Constrainer:
   def setConstrainFactor( self , fac , loadCase = "All_" ):
 
     if loadCase == "All_":
-      for name in self.constrainedFac.keys():
-        self.constrainedFac[name] = fac
+      self.constrainedFac = dict.fromkeys( self.constrainedFac , fac )
+      self.factors.fill( fac )
     else:
       self.constrainedFac[loadCase] = fac
+      if loadCase in self.labelIndex:
+        self.factors[self.labelIndex[loadCase]] = fac
       
 #-------------------------------------------------------------------------------
 #
@@ -209,8 +361,7 @@ class Constrainer:
 
   def setPrescribedDofs( self , a , val = 0.0 ):
   
-    for name in self.constrainedDofs.keys():             
-      a[self.constrainedDofs[name]] = array( val )
+    a[self.allDofs] = val
       
 #-------------------------------------------------------------------------------
 #
@@ -28,20 +28,50 @@
 #  event caused by the use of the program.                                     #
 ################################################################################
 
-from numpy import array, dot, zeros, where
+from numpy import array, asarray, arange, zeros, full, dot, sqrt, empty, sort, isfinite, fromiter, intp, ix_, ndarray
+
 import scipy.linalg
 
-from scipy.sparse.linalg   import spsolve
+from scipy.sparse          import csr_matrix, issparse
+from scipy.sparse.csgraph  import reverse_cuthill_mckee
+from scipy.sparse.linalg   import splu
 from scipy.sparse.linalg   import eigsh
 from pyfem.util.itemList   import itemList
 from pyfem.util.fileParser import readNodeTable
 from pyfem.util.logger     import getLogger
 from pyfem.fem.Constrainer import Constrainer
 
-from copy import deepcopy
-
 logger = getLogger()
 
+# Below these sizes a per-ID dict lookup is faster than the vectorized
+# path. The values are near the crossover points measured for each lookup
+# (roughly 150 IDs and 20 nodes with two dof types).
+
+rowTableMinSize = 256    # node IDs: dict lookup vs. row table (getRows)
+gatherMinNodes  = 16     # nodes: per-node lookup vs. ix_ gather (getForTypes)
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+def matrixKey( A ):
+
+  '''
+  Returns a cheap fingerprint of the storage of matrix A: the number of
+  stored entries and the address of the value array. It changes when the
+  sparsity pattern or the value array of A is replaced.
+  '''
+
+  if issparse( A ):
+    if hasattr( A , "data" ):
+      return ( A.shape , A.nnz , A.data.ctypes.data )
+    return ( A.shape , A.nnz )
+
+  return ( A.shape , asarray( A ).ctypes.data )
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
 
 class DofSpace:
 
@@ -55,15 +85,44 @@ class DofSpace:
     Constructor
     '''
     
-    self.dofTypes = elements.getDofTypes()
-    self.dofs     = array( list(range( len(elements.nodes) * len(self.dofTypes))) ).reshape( ( len(elements.nodes), len(self.dofTypes) ) )
+    self.dofTypes  = elements.getDofTypes()
+    self.typeIndex = { dofType : i for i,dofType in enumerate(self.dofTypes) }
+
+    # Dof numbers are stored as intp, the native index type of numpy, so
+    # that they index the state vectors and matrices without conversion.
+
+    nNodes = len(elements.nodes)
+    nTypes = len(self.dofTypes)
+
+    self.dofs     = arange( nNodes * nTypes , dtype=intp ).reshape( ( nNodes, nTypes ) )
     self.nodes    = elements.nodes
+
+    # Position of each dof in the dof table. None as long as the dofs are
+    # numbered row by row, see reorder.
+
+    self.dofPosition = None
     
     #Create the ID map
     self.IDmap = itemList()
     for ind,ID in enumerate(elements.nodes):
       self.IDmap.add( ID, ind )
 
+    # When the node IDs are numbered (almost) contiguously, a table from
+    # node ID to row is kept as well, to look up large batches at once.
+
+    self.rowTable  = None
+    self.rowOffset = 0
+
+    IDs = list( self.IDmap.keys() )
+
+    if len(IDs) > 0 and all( type(ID) is int for ID in IDs ):
+      self.rowOffset = min(IDs)
+      span           = max(IDs) - self.rowOffset + 1
+
+      if span <= 4 * len(IDs):
+        self.rowTable = full( span , -1 , dtype=intp )
+        self.rowTable[array( IDs ) - self.rowOffset] = arange( len(IDs) )
+
     self.allConstrainedDofs = []
 
 #-------------------------------------------------------------------------------
@@ -89,7 +148,7 @@ class DofSpace:
     degrees of freedeom
     '''
        
-    return len(self.dofs.flatten())
+    return self.dofs.size
 
 #-------------------------------------------------------------------------------
 #
@@ -97,11 +156,7 @@ class DofSpace:
 
   def setConstrainFactor( self , fac , loadCase = "All_" ):
 
-    if loadCase == "All_":
-      for name in self.cons.constrainedFac.keys():
-        self.cons.constrainedFac[name] = fac
-    else:
-      self.cons.constrainedFac[loadCase] = fac
+    self.cons.setConstrainFactor( fac , loadCase )
 
 #-------------------------------------------------------------------------------
 #
@@ -142,23 +197,36 @@ class DofSpace:
       cons.constrainedVals[label] = []
       cons.constrainedFac [label] = 1.0
       
-      for item in nodeTable.data:
+      # Resolve the dof numbers of all rows in the table at once
 
-        nodeID  = item[1]
-        dofType = item[0]
-        val     = item[2]
-        
-        if not nodeID in self.nodes:
-          raise RuntimeError('Node ID ' + str(nodeID) + ' does not exist')
+      nodeIDs  = [ item[1] for item in nodeTable.data ]
+      dofTypes = [ item[0] for item in nodeTable.data ]
 
-        ind = self.IDmap.get( nodeID )
+      missing = set( nodeIDs ).difference( self.nodes )
 
-        if dofType not in self.dofTypes:
-          raise RuntimeError('DOF type "' + dofType + '" does not exist')
-      
-        if len(item) == 3:          
-          dofID = self.dofs[ind,self.dofTypes.index(dofType)]
-        
+      if len(missing) > 0:
+        raise RuntimeError('Node ID ' + str(min(missing)) + ' does not exist')
+
+      missing = set( dofTypes ).difference( self.typeIndex )
+
+      if len(missing) > 0:
+        raise RuntimeError('DOF type "' + missing.pop() + '" does not exist')
+
+      inds   = array( self.getRows( nodeIDs ) , dtype=int )
+      cols   = array( [ self.typeIndex[dofType] for dofType in dofTypes ] , dtype=int )
+      dofIDs = self.dofs[inds,cols].tolist()
+
+      if all( len(item) == 3 for item in nodeTable.data ):
+        cons.addConstraints( dofIDs , [ item[2] for item in nodeTable.data ] , label )
+        continue
+
+      # Tyings are added one by one to preserve the order of the table
+
+      for dofID,item in zip( dofIDs , nodeTable.data ):
+
+        val = item[2]
+
+        if len(item) == 3:
           cons.addConstraint(dofID,val,label)
         else:
           slaveNodeID  = item[4]
@@ -170,12 +238,12 @@ class DofSpace:
 
           slaveInd = self.IDmap.get( slaveNodeID )
 
-          if slaveDofType not in self.dofTypes:
+          slaveCol = self.typeIndex.get( slaveDofType )
+
+          if slaveCol is None:
             raise RuntimeError('DOF type "' + slaveDofType + '" does not exist')
       
-          slaveDof = self.dofs[slaveInd,self.dofTypes.index(slaveDofType)]
-
-          dofID = self.dofs[ind,self.dofTypes.index(dofType)]
+          slaveDof = self.dofs[slaveInd,slaveCol]
 
           cons.addConstraint(dofID , [ val , slaveDof , factor ] , label )     
       
@@ -186,6 +254,54 @@ class DofSpace:
 
     return cons
 
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def getRows ( self, nodeIDs ):
+  
+    '''
+    Returns the row(s) in the dof table of a node ID or a list of node IDs.
+    Arrays and long lists are looked up in the row table; for a few nodes,
+    e.g. those of a single element, the dict lookup is faster.
+    '''
+
+    if self.rowTable is None or isinstance( nodeIDs , int ) or \
+       ( not isinstance( nodeIDs , ndarray ) and len(nodeIDs) < rowTableMinSize ):
+      return self.mapRows( nodeIDs )
+
+    pos = asarray( nodeIDs , dtype=intp ) - self.rowOffset
+
+    # Unknown node IDs are passed on to the ID map, which raises the error
+
+    if pos.size > 0 and ( pos.min() < 0 or pos.max() >= len(self.rowTable) ):
+      return self.mapRows( nodeIDs )
+
+    rows = self.rowTable[pos]
+
+    if ( rows < 0 ).any():
+      return self.mapRows( nodeIDs )
+
+    return rows
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def mapRows ( self, nodeIDs ):
+  
+    '''
+    Returns the row(s) in the dof table of a node ID or a list of node IDs
+    from the ID map. For an array of node IDs, an intp array of the same
+    shape is returned.
+    '''
+
+    if isinstance( nodeIDs , ndarray ):
+      rows = fromiter( map( self.IDmap.__getitem__ , nodeIDs.ravel().tolist() ) , dtype=intp , count=nodeIDs.size )
+      return rows.reshape( nodeIDs.shape )
+
+    return self.IDmap.get( nodeIDs )
+
 #-------------------------------------------------------------------------------
 #
 #-------------------------------------------------------------------------------
@@ -196,7 +312,7 @@ class DofSpace:
     Returns all dofIDs for given dofType for a list of nodes
     '''
    
-    return self.dofs[self.IDmap.get( nodeIDs ), self.dofTypes.index(dofType)]
+    return self.dofs[self.getRows( nodeIDs ), self.typeIndex[dofType]]
       
 #-------------------------------------------------------------------------------
 #
@@ -205,16 +321,24 @@ class DofSpace:
   def getForTypes( self, nodeIDs, dofTypes ):
   
     '''
-    Returns all dofIDs for given list of dofType for a list of nodes
+    Returns all dofIDs for given list of dofType for a list of nodes. The
+    dofs are ordered per node, and per node in the order of dofTypes, and
+    are returned as a list. For a few nodes, e.g. those of a single element,
+    the dofs are looked up one by one; larger sets are gathered from the dof
+    table at once.
     '''
 
-    dofs = []
-        
-    for node in nodeIDs:
-      for dofType in dofTypes:
-        dofs.append(self.dofs[self.IDmap.get( node ),self.dofTypes.index(dofType)])
+    if not isinstance( nodeIDs , ( list , ndarray ) ):
+      nodeIDs = list( nodeIDs )
+
+    cols = [ self.typeIndex[dofType] for dofType in dofTypes ]
+
+    if len(nodeIDs) < gatherMinNodes:
+      return [ self.dofs[self.IDmap[ID],col] for ID in nodeIDs for col in cols ]
+
+    rows = self.getRows( nodeIDs )
       
-    return dofs
+    return self.dofs[ix_( rows , cols )].ravel().tolist()
     
 #-------------------------------------------------------------------------------
 #
@@ -238,7 +362,7 @@ class DofSpace:
     Returns the node ID of dofID
     '''
     
-    return self.nodes.findID(int(where(self.dofs == dofID)[0]))
+    return self.nodes.findID( self.getPosition(dofID) // len(self.dofTypes) )
     
 #-------------------------------------------------------------------------------
 #
@@ -250,7 +374,23 @@ class DofSpace:
     Returns the type of dofID
     '''
   
-    return int(where(self.dofs == dofID)[1])
+    return self.getPosition(dofID) % len(self.dofTypes)
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def getPosition( self, dofID ):
+  
+    '''
+    Returns the flat position of dofID in the dof table. Without reordering,
+    the table is numbered row by row and the position equals the dof number.
+    '''
+
+    if self.dofPosition is None:
+      return int(dofID)
+  
+    return int(self.dofPosition[dofID])
     
 #-------------------------------------------------------------------------------
 #
@@ -271,8 +411,60 @@ class DofSpace:
   def get ( self, nodeIDs ):
   
     '''Returns all dofIDs for a list of nodes'''
+
+    # A single row is wrapped in a list so that the result is always a
+    # gathered copy, which can be raveled without referring to the table.
+
+    rows = self.getRows(nodeIDs)
+
+    if isinstance( rows , int ):
+      rows = [ rows ]
     
-    return self.dofs[self.IDmap.get(nodeIDs)].flatten()
+    return self.dofs[rows].ravel()
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def reorder ( self, order ):
+  
+    '''
+    Renumbers the dofs such that the dof at position k in order obtains the
+    number k, e.g. with the ordering returned by computeRCM. The constraints
+    of the dof space are renumbered as well; copies made earlier with
+    copyConstrainer and vectors indexed by dof number are not.
+    '''
+
+    order = array( order , dtype=intp )
+
+    if order.shape != ( len(self), ) or not ( sort( order ) == arange( len(self) ) ).all():
+      raise RuntimeError('Illegal dof ordering')
+
+    newNumber = empty( len(self) , dtype=self.dofs.dtype )
+    newNumber[order] = arange( len(self) , dtype=self.dofs.dtype )
+
+    if self.dofPosition is None:
+      self.dofPosition = order
+    else:
+      self.dofPosition = self.dofPosition[order]
+
+    self.dofs = newNumber[self.dofs]
+
+    if hasattr( self , "cons" ):
+      self.cons.renumber( newNumber )
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def computeRCM ( self, A ):
+  
+    '''
+    Returns the reverse Cuthill-McKee ordering of the dofs for the sparsity
+    pattern of the matrix A, which can be passed to reorder.
+    '''
+
+    return reverse_cuthill_mckee( csr_matrix( A ) , symmetric_mode=True )
 
 #-------------------------------------------------------------------------------
 #
@@ -281,18 +473,21 @@ class DofSpace:
   def copyConstrainer( self , dofTypes: list = None ):
   
     '''
-    
+    Returns a copy of the constrainer in which all dofs of the given dofTypes
+    are additionally prescribed to zero for every label.
     '''
     
-    newCons = deepcopy(self.cons)
+    newCons = self.cons.clone()
        
-    if type(dofTypes) is str:
+    if dofTypes is None:
+      dofTypes = []
+    elif type(dofTypes) is str:
       dofTypes = [dofTypes]
           
     for dofType in dofTypes:
-      for iDof in self.dofs[:,self.dofTypes.index(dofType)]:
-        for label in newCons.constrainedFac.keys():
-          newCons.addConstraint(iDof,0.0,label)
+      dofIDs = self.dofs[:,self.typeIndex[dofType]].tolist()
+      for label in newCons.constrainedFac.keys():
+        newCons.addConstraints( dofIDs , 0.0 , label )
                   
     newCons.flush()
                   
@@ -302,29 +497,57 @@ class DofSpace:
 #  
 #-------------------------------------------------------------------------------
 
-  def solve ( self, A, b, constrainer = None ):
+  def solve ( self, A, b, constrainer = None, reuseFactor = False ):
 
     '''Solves the system Ax = b using the internal constraints matrix.
-       Returns the total solution vector x.'''
+       Returns the total solution vector x.
+
+       With reuseFactor, the factorization is kept in the constrainer and
+       reused by the next call with reuseFactor for the same, unmodified
+       matrix, e.g. for multiple right hand sides in the Riks solver. A
+       matrix that is modified in place keeps its identity and storage; in
+       that case call constrainer.invalidateFactor() first.'''
     
     if constrainer is None:
       constrainer = self.cons
       
     if len(A.shape) == 2:
 
-      a = zeros(len(self))
-      
-      constrainer.addConstrainedValues( a )
+      if not reuseFactor or A is not constrainer.factorMatrix or \
+         matrixKey( A ) != constrainer.factorKey:
+        self.factorize( A, constrainer )
+
+      # The prescribed values enter the reduced right hand side through the
+      # reduced prescribed columns of A, which are stored with the
+      # factorization. The correction is skipped altogether when all
+      # prescribed values are zero, which is the usual case within the
+      # iterations of a nonlinear solver.
+
+      prescribedVals = constrainer.getPrescribedValues()
+
+      if constrainer.hasTyings:
+        b_constrained = constrainer.CT @ b
+      else:
+        free = constrainer.freeIdx
+
+        b_constrained = b[free]
 
-      A_constrained = constrainer.C.transpose() * (A * constrainer.C )
+      if prescribedVals.any():
+        b_constrained = b_constrained - constrainer.factorCols @ prescribedVals
 
-      b_constrained = constrainer.C.transpose() * ( b - A * a )
+      x_constrained = constrainer.factor.solve( b_constrained )
 
-      x_constrained = spsolve( A_constrained, b_constrained )
+      if constrainer.hasTyings:
+        x = constrainer.C @ x_constrained
+      else:
+        x = zeros( len(self) )
 
-      x = constrainer.C * x_constrained
+        x[free] = x_constrained
 
       constrainer.addConstrainedValues( x )
+
+      if not reuseFactor:
+        constrainer.invalidateFactor()
           
     elif len(A.shape) == 1:
       x = b / A
@@ -334,6 +557,38 @@ class DofSpace:
     return x
     
     
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def factorize ( self, A, constrainer ):
+
+    '''Computes the LU factorization of the constrained system of A and
+       stores it in the constrainer, together with the reduced columns of
+       the prescribed dofs.'''
+
+    Acsr = csr_matrix( A )
+
+    cols = Acsr[:,constrainer.prescribedIdx]
+
+    if constrainer.hasTyings:
+      A_constrained = self.project( Acsr , constrainer )
+      cols          = constrainer.CT @ cols
+    else:
+
+      # Without tyings, C only selects the free dofs and the constrained
+      # system is a submatrix of A.
+
+      free = constrainer.freeIdx
+
+      A_constrained = Acsr[free][:,free]
+      cols          = cols[free]
+
+    constrainer.factorMatrix = A
+    constrainer.factorKey    = matrixKey( A )
+    constrainer.factorCols   = cols.tocsr()
+    constrainer.factor       = splu( A_constrained.tocsc() )
+
 #-------------------------------------------------------------------------------
 #
 #-------------------------------------------------------------------------------
@@ -343,18 +598,30 @@ class DofSpace:
     '''Calculates the first count eigenvalues and eigenvectors of a
        system with ( A lambda B ) x '''
        
-    A_constrained = dot( dot( self.cons.C.transpose(), A ), self.cons.C )
-    B_constrained = dot( dot( self.cons.C.transpose(), B ), self.cons.C )
+    A_constrained = self.project( A , self.cons )
+    B_constrained = self.project( B , self.cons )
 
     eigvals , eigvecs = eigsh( A_constrained, count , B_constrained , sigma = 0. , which = 'LM' )
 
-    x = zeros(shape=(len(self),count))
-
-    for i,psi in enumerate(eigvecs.transpose()):
-      x[:,i] = self.cons.C * psi
+    x = self.cons.C @ eigvecs
       
     return eigvals,x
 
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def project( self, A , constrainer ):
+
+    '''Returns the constrained matrix C^T A C. A sparse matrix stays sparse;
+       for a dense matrix, the sparse products with C are applied to the
+       dense array directly, so that C is never densified.'''
+
+    if issparse( A ):
+      return constrainer.CT @ ( csr_matrix( A ) @ constrainer.C )
+    else:
+      return constrainer.CT @ ( constrainer.CT @ A.T ).T
+
 #-------------------------------------------------------------------------------
 #
 #-------------------------------------------------------------------------------
@@ -368,7 +635,20 @@ class DofSpace:
     if constrainer is None:
       constrainer = self.cons
     
-    return scipy.linalg.norm( constrainer.C.transpose() * r )
+    if constrainer.hasTyings:
+      y = asarray( constrainer.CT @ r ).ravel()
+    else:
+      y = r[constrainer.freeIdx]
+
+    res = sqrt( dot( y , y ) )
+
+    # scipy.linalg.norm raises an error for a residual that contains infs or
+    # NaNs, and avoids overflow for very large entries.
+
+    if not isfinite( res ):
+      return scipy.linalg.norm( y )
+
+    return res
     
 #-------------------------------------------------------------------------------
 #
@@ -383,6 +663,12 @@ class DofSpace:
     if constrainer is None:
       constrainer = self.cons
     
-    a[constrainer.constrainedDofs["None"]] = val
+    # Tables without a sub label are stored under "None"; when there are
+    # none, nothing is masked.
+
+    idx = constrainer.constrainedIdx.get( "None" )
+
+    if idx is not None:
+      a[idx] = val
     
     return a
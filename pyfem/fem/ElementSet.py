@@ -28,10 +28,12 @@
 #  event caused by the use of the program.                                     #
 ################################################################################
 
-import re
+from itertools import chain, groupby
+from numpy import array, append, ndarray, fromiter, zeros, int8, int32
 from pyfem.util.itemList import itemList
 from pyfem.util.logger   import getLogger
 from pyfem.util.dataStructures import solverStatus
+from pyfem.util.fileParser     import dropChars
 
 logger = getLogger()
 
@@ -45,6 +47,10 @@ class ElementSet( itemList ):
     self.props  = props
     self.solverStat = solverStatus()
     self.groups = {}
+    self.modelClasses = {}
+    self.groupDofTypes = {}
+    self.groupElements = {}
+    self.groupConnectivity = {}
 
 #-------------------------------------------------------------------------------
 #
@@ -52,13 +58,7 @@ class ElementSet( itemList ):
 
   def __iter__ ( self ):
 
-    elements = []
-
-    for groupName in self.iterGroupNames():
-      for element in self.iterElementGroup( groupName ):
-        elements.append( element )
-       
-    return iter( elements )
+    return chain.from_iterable( self.iterElementGroup( groupName ) for groupName in self.iterGroupNames() )
 
 #-------------------------------------------------------------------------------
 #
@@ -83,14 +83,21 @@ class ElementSet( itemList ):
 
   def getDofTypes ( self ):
 
-    dofTypes = []
+    # A dict keeps the dof types unique in order of appearance. The dof
+    # types of the model groups are collected when elements are added;
+    # only groups set with addGroup are scanned here.
 
-    for element in self:
-      for dofType in element.dofTypes:
-        if dofType not in dofTypes:
-          dofTypes.append( dofType )
+    dofTypes = {}
 
-    return dofTypes
+    for groupName in self.iterGroupNames():
+      if groupName in self.groupDofTypes:
+        dofTypes.update( self.groupDofTypes[groupName] )
+      else:
+        for element in self.iterElementGroup( groupName ):
+          for dofType in element.dofTypes:
+            dofTypes[dofType] = None
+
+    return list( dofTypes )
     
 #-------------------------------------------------------------------------------
 #
@@ -101,34 +108,54 @@ class ElementSet( itemList ):
     logger.info("  Reading elements")
     logger.info("  -----------------------------------------------------------")        
     
-    fin = open( fname )
-  
-    while True:
-      line = fin.readline()  
+    with open( fname , buffering = 2**20 ) as fin:
+
+      line = fin.readline()
   
-      if line.startswith('<Elements>') == True:
-        while True:
-          line = fin.readline()  
+      while line:
+        if line.startswith('<Elements>'):
 
-          if line.startswith('</Elements>') == True:
-            return
-        
-          line = re.sub(r'\s{2,}',' ',line)
-          a = line.split(';')
-     
-          for a0 in a[:-1]:
-            b = a0.strip().split(' ')
-            
-            if b[0].startswith("//") or b[0].startswith("#"):
+          # The remainder of the file is read at once and split into lines.
+          # Text after the last ';' on a line is ignored.
+
+          rows = []
+
+          for line in fin.read().split('\n'):
+            if line.startswith('</Elements>'):
               break
-            if len(b) > 1 and type(eval(b[0])) == int:
-              self.add( eval(b[0]), eval(b[1]) , [eval(nodeID) for nodeID in b[2:]] )  
-
-      elif line.startswith('gmsh') == True:
-        ln = line.replace('\n','').replace('\t','').replace(' ','').replace('\r','').replace(';','')
-        ln = ln.split('=',1)
-        self.readGmshFile( ln[1][1:-1] )
-        return
+        
+            for a0 in line.split(';')[:-1]:
+              b = a0.split()
+
+              if len(b) == 0:
+                continue
+              if b[0].startswith( ("//","#") ):
+                break
+
+              try:
+                ID = int(b[0])
+              except ValueError:
+                continue
+
+              if len(b) > 1:
+                rows.append( ( ID, b[1].strip('\'"') , [int(nodeID) for nodeID in b[2:]] ) )
+
+          # Consecutive elements of the same model are added at once
+
+          for modelName,run in groupby( rows , key = lambda row : row[1] ):
+            run = list( run )
+            self.addMany( [ row[0] for row in run ] , modelName , [ row[2] for row in run ] )
+
+          break
+
+        elif line.startswith('gmsh'):
+          ln = line.translate( dropChars ).split('=',1)
+          self.readGmshFile( ln[1][1:-1] )
+          break
+
+        line = fin.readline()
+
+    self.finalizeGroups()
         
 #-------------------------------------------------------------------------------
 #
@@ -142,12 +169,15 @@ class ElementSet( itemList ):
     
     elemID = 0
 
+    # The connectivity of all cells of a set and type is gathered at once
+
     for key in mesh.cell_sets_dict: 
       for typ in mesh.cell_sets_dict[key]:
-        for idx in mesh.cell_sets_dict[key][typ]:
-          iNodes = mesh.cells_dict[typ][idx]
-          self.add( elemID , key , iNodes.tolist() )
-          elemID = elemID + 1
+        conn = mesh.cells_dict[typ][mesh.cell_sets_dict[key][typ]].tolist()
+
+        self.addMany( range( elemID , elemID + len(conn) ) , key , conn )
+
+        elemID = elemID + len(conn)
                                  
 #-------------------------------------------------------------------------------
 #  add element
@@ -156,21 +186,12 @@ class ElementSet( itemList ):
   def add ( self, ID, modelName, elementNodes ):  
 
     #Check if the model exists
+
+    model = self.getModel( modelName )
     
-    if hasattr( self.props, modelName ):
+    if model is not None:
     
-      modelProps = getattr( self.props, modelName )
-
-      #Check if the model has a type
-      if not hasattr( modelProps, 'type' ):
-        raise RuntimeError('Missing type for model ' + modelName)
-      
-      modelType = getattr( modelProps, 'type' )
- 
-      modelProps.rank       = self.nodes.rank
-      modelProps.solverStat = self.solverStat
-
-      element = getattr(__import__('pyfem.elements.'+modelType , globals(), locals(), modelType , 0 ), modelType )
+      element , modelProps = model
 
       #Create the element
  
@@ -178,9 +199,7 @@ class ElementSet( itemList ):
 
       #  Check if the node IDs are valid:
 
-      for nodeID in elem.getNodes():
-        if not nodeID in self.nodes:
-          raise RuntimeError('Node ID ' + str(nodeID) + ' does not exist')
+      self.checkNodes( elem.getNodes() )
 
       #  Add the element to the element set:
 
@@ -188,18 +207,153 @@ class ElementSet( itemList ):
 
       #  Add the element to the correct group:
 
+      dofTypes = self.getGroupDofTypes( modelName )
+
       self.addToGroup( modelName, ID )
 
+      if dofTypes is not None:
+        for dofType in elem.dofTypes:
+          dofTypes[dofType] = None
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def addMany ( self, IDs, modelName, connectivity ):
+
+    '''
+    Adds a series of elements of the same model. The model is resolved and
+    the node IDs are checked once for all elements.
+    '''
+
+    model = self.getModel( modelName )
+
+    if model is None:
+      return
+
+    element , modelProps = model
+
+    self.checkNodes( nodeID for elementNodes in connectivity for nodeID in elementNodes )
+
+    dofTypes = self.getGroupDofTypes( modelName )
+
+    elems = [ element( elementNodes , modelProps ) for elementNodes in connectivity ]
+
+    itemList.addMany( self, IDs, elems )
+
+    if dofTypes is not None:
+      for elem in elems:
+        for dofType in elem.dofTypes:
+          dofTypes[dofType] = None
+
+    self.clearGroupCache( modelName )
+
+    group = self.groups.get( modelName )
+
+    if group is None:
+      self.groups[modelName] = list( IDs )
+    elif isinstance( group, list ):
+      group.extend( IDs )
+    else:
+      self.groups[modelName] = append( group, list( IDs ) )
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def getGroupDofTypes ( self, groupName ):
+
+    '''
+    Returns the dict with the dof types collected for group groupName, which
+    is created for a new group. Returns None for a group that was set with
+    addGroup; its dof types are determined in getDofTypes.
+    '''
+
+    if groupName not in self.groups:
+      self.groupDofTypes[groupName] = {}
+
+    return self.groupDofTypes.get( groupName )
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def getModel ( self, modelName ):
+
+    '''
+    Returns the element class and the properties of model modelName, or
+    None when the model is not defined in the input.
+    '''
+
+    if not hasattr( self.props, modelName ):
+      return None
+    
+    modelProps = getattr( self.props, modelName )
+
+    #Check if the model has a type
+    if not hasattr( modelProps, 'type' ):
+      raise RuntimeError('Missing type for model ' + modelName)
+      
+    modelType = getattr( modelProps, 'type' )
+ 
+    modelProps.rank       = self.nodes.rank
+    modelProps.solverStat = self.solverStat
+
+    # The element class is imported once per model type
+
+    element = self.modelClasses.get( modelType )
+
+    if element is None:
+      element = getattr(__import__('pyfem.elements.'+modelType , globals(), locals(), modelType , 0 ), modelType )
+      self.modelClasses[modelType] = element
+
+    return element , modelProps
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def checkNodes( self, nodeIDs ):
+
+    '''
+    Raises an error when one of the node IDs does not exist.
+    '''
+
+    missing = set( nodeIDs ).difference( self.nodes )
+
+    if len(missing) > 0:
+      raise RuntimeError('Node ID ' + str(min(missing)) + ' does not exist')
+
 #-------------------------------------------------------------------------------
 #
 #-------------------------------------------------------------------------------
 
   def addToGroup( self, modelType, ID ):
 
-    if modelType not in self.groups:
+    self.clearGroupCache( modelType )
+
+    group = self.groups.get( modelType )
+
+    if group is None:
       self.groups[modelType] = [ID]
+    elif isinstance( group, list ):
+      group.append( ID )
     else:
-      self.groups[modelType].append( ID )
+      self.groups[modelType] = append( group, ID )
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def finalizeGroups( self ):
+
+    '''
+    Stores the element IDs of each group in a contiguous integer array.
+    During reading, the groups are collected in lists.
+    '''
+
+    for name,group in self.groups.items():
+      self.groups[name] = array( group, dtype=int )
 
 #-------------------------------------------------------------------------------
 #
@@ -207,6 +361,8 @@ class ElementSet( itemList ):
 
   def addGroup ( self, groupName,  groupIDs ):
     self.groups[groupName] = groupIDs
+    self.groupDofTypes.pop( groupName, None )
+    self.clearGroupCache( groupName )
 
 #-------------------------------------------------------------------------------
 #
@@ -223,12 +379,95 @@ class ElementSet( itemList ):
     if groupName == "All":
       return iter( self )
     elif isinstance(groupName, list):
-      elems = []
-      for name in groupName:
-        elems += self.get(self.groups[name])
-      return iter( elems )
+      return chain.from_iterable( self.getGroup( name ) for name in groupName )
     else:
-      return iter( self.get( self.groups[groupName] ) )
+      return iter( self.getGroup( groupName ) )
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def getGroup ( self, groupName ):
+
+    '''
+    Returns a list with the elements in group groupName. The IDs of a group
+    can be stored in a list or in an integer array. The list is stored and
+    reused until the group changes.
+    '''
+
+    elems = self.groupElements.get( groupName )
+
+    if elems is None:
+      IDs = self.groups[groupName]
+
+      if isinstance( IDs, ndarray ):
+        IDs = IDs.tolist()
+
+      elems = self.get( IDs )
+      self.groupElements[groupName] = elems
+
+    return elems
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def getGroupConnectivity ( self, groupName ):
+
+    '''
+    Returns the node IDs of the elements in group groupName as an int32
+    array with one row per element. All elements in the group must have
+    the same number of nodes.
+    '''
+
+    conn = self.groupConnectivity.get( groupName )
+
+    if conn is None:
+      elems = self.getGroup( groupName )
+
+      if len( set( len( elem.getNodes() ) for elem in elems ) ) > 1:
+        raise RuntimeError( 'Elements in group ' + groupName + ' have a different number of nodes' )
+
+      if len(elems) == 0:
+        conn = zeros( ( 0 , 0 ) , dtype=int32 )
+      else:
+        conn = array( [ elem.getNodes() for elem in elems ], dtype=int32 )
+      self.groupConnectivity[groupName] = conn
+
+    return conn
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def getGroupCoords ( self, groupName ):
+
+    '''
+    Returns the nodal coordinates of the elements in group groupName as an
+    array of shape (elements, nodes per element, rank).
+    '''
+
+    conn = self.getGroupConnectivity( groupName )
+
+    if conn.size == 0:
+      return zeros( conn.shape + ( max( self.nodes.rank , 0 ) , ) )
+
+    crds = self.nodes.getNodeCoords( conn.ravel().tolist() )
+
+    return crds.reshape( conn.shape + crds.shape[1:] )
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def clearGroupCache ( self, groupName ):
+
+    '''
+    Drops the element list and connectivity stored for group groupName.
+    '''
+
+    self.groupElements.pop( groupName, None )
+    self.groupConnectivity.pop( groupName, None )
 
 #-------------------------------------------------------------------------------
 #
@@ -251,14 +490,9 @@ class ElementSet( itemList ):
 
   def getFamilyIDs(self):
   
-    familyIDs = []
-    fam = ["CONTINUUM","INTERFACE","SURFACE","BEAM","SHELL"]
+    fam = { "CONTINUUM" : 0 , "INTERFACE" : 1 , "SURFACE" : 2 , "BEAM" : 3 , "SHELL" : 4 }
     
-    for elem in self:
-      
-      familyIDs.append(fam.index(elem.family))
-      
-    return familyIDs
+    return fromiter( ( fam[elem.family] for elem in self ) , dtype=int8 )
 
 #-------------------------------------------------------------------------------
 #
@@ -266,5 +500,5 @@ class ElementSet( itemList ):
 
   def commitHistory ( self ):
 
-    for element in list(self.values()):
+    for element in self.values():
       element.commitHistory()
@@ -28,10 +28,10 @@
 #  event caused by the use of the program.                                     #
 ################################################################################
 
-from numpy import array
+from numpy import array, concatenate, empty, intp
+from itertools import chain
 from pyfem.util.itemList import itemList
-from pyfem.util.fileParser import getType
-import re,sys
+from pyfem.util.fileParser import isInteger, toFloat, dropChars, labelChars
 
 from pyfem.util.logger   import getLogger
 
@@ -44,15 +44,70 @@ logger = getLogger()
 class NodeSet( itemList ):
 
   def __init__( self ):
-    self.rank = -1
-    self.groups = {}
+    itemList.__init__( self )
+    self.rank     = -1
+    self.groups   = {}
+    self.coords   = None
+    self.uniform  = True
+    self.rowIndex = {}
+    self.groupRows = {}
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def add( self, ID, crd ):
+
+    itemList.add( self, ID, crd )
+    self.coords = None
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def addMany( self, IDs, crds ):
+
+    itemList.addMany( self, IDs, crds )
+    self.coords = None
 
 #-------------------------------------------------------------------------------
 #
 #-------------------------------------------------------------------------------
 
   def getNodeCoords( self, nodeIDs ):
-    return array( self.get( nodeIDs ) )
+
+    # The coordinates are gathered from a contiguous (N,rank) array that is
+    # (re)built on first use after nodes have been added. nodeIDs can also
+    # be the name of a node group, of which the rows are stored. When the
+    # nodes have a different number of coordinates, they are looked up one
+    # by one.
+
+    if self.coords is None:
+      crds = list( self.values() )
+
+      self.uniform   = len( set( len( crd ) for crd in crds ) ) <= 1
+      self.coords    = array( crds ) if self.uniform else empty( ( 0 , 0 ) )
+      self.rowIndex  = self.getIndexMap()
+      self.groupRows = {}
+
+    if not self.uniform:
+      if isinstance( nodeIDs , str ):
+        nodeIDs = self.groups[nodeIDs]
+      return array( self.get( nodeIDs ) )
+
+    if isinstance( nodeIDs , int ):
+      return self.coords[self.rowIndex[nodeIDs]].copy()
+
+    if isinstance( nodeIDs , str ):
+      rows = self.groupRows.get( nodeIDs )
+
+      if rows is None:
+        rows = array( [ self.rowIndex[ID] for ID in self.groups[nodeIDs] ] , dtype=intp )
+        self.groupRows[nodeIDs] = rows
+
+      return self.coords.take( rows , axis=0 )
+
+    return self.coords.take( [ self.rowIndex[ID] for ID in nodeIDs ] , axis=0 )
 
 #-------------------------------------------------------------------------------
 #
@@ -63,36 +118,32 @@ class NodeSet( itemList ):
     logger.info("  Reading nodes")
     logger.info("  -----------------------------------------------------------")    
 
-    fin = open( fname , 'r' )
-    
-    line = fin.readline() 
-    
-    while line:    
-      if line.replace(" ","").startswith('<Nodes>'):
-        self.readNodalCoords( fin )
+    # The file is read at once and parsed in a single pass; the blocks are
+    # read from an iterator over its lines. Nodes that follow a gmsh
+    # entry are ignored.
+
+    with open( fname , 'r' ) as fin:
+      lines = iter( fin.read().split('\n') )
+
+    readCoords = True
 
-      if line.replace(" ","").startswith('gmsh'):
-        ln = line.replace('\n','').replace('\t','').replace(' ','').replace('\r','').replace(';','')
-        ln = ln.split('=',1)
+    for line in lines:
+      tag = line.replace(" ","")
+
+      if readCoords and tag.startswith('<Nodes>'):
+        self.readNodalCoords( lines )
+
+      if readCoords and tag.startswith('gmsh'):
+        ln = line.translate( dropChars ).split('=',1)
         self.readGmshFile( ln[1][1:-1] )       
-        break        
+        readCoords = False
        
-      line = fin.readline() 
-      
-    fin = open( fname , 'r' )
-    
-    line = fin.readline() 
-    
-    while line:  
-      if line.replace(" ","").startswith('<NodeGroup'):
+      if tag.startswith('<NodeGroup'):
         if 'name' in line:
-          label = line.split('=')[1].replace('\n','').replace('>','').replace(' ','').replace('\"','').replace('\'','')
-          self.readNodegroup( fin , label )
-       
-      line = fin.readline()       
+          label = line.split('=')[1].translate( labelChars )
+          self.readNodegroup( lines , label )
           
-    for key in self.groups:
-      self.groups[key] = list(set(self.groups[key]))
+    self.finalizeGroups()
               
 #-------------------------------------------------------------------------------
 #
@@ -104,27 +155,28 @@ class NodeSet( itemList ):
     
     mesh = meshio.read(fname,file_format="gmsh")
 
-    obj3d = ["pris","pyra","hexa","wedg","tetr"]
+    obj3d = { "pris","pyra","hexa","wedg","tetr" }
     
     self.rank = 2
 
-    for key in mesh.cell_sets_dict:
-      for typ in mesh.cell_sets_dict[key]:
-        if( typ[:4] in obj3d ):
-          self.rank = 3
+    if any( typ[:4] in obj3d for cellSets in mesh.cell_sets_dict.values() for typ in cellSets ):
+      self.rank = 3
         
-    for nodeID,p in enumerate(mesh.points):
-      self.add(nodeID,p[:self.rank])
+    self.addMany( range( len( mesh.points ) ) , mesh.points[:,:self.rank].tolist() )
+
+    # The nodes of a group are collected per cell type in one array.
 
-    for key in mesh.cell_sets_dict:
+    for key,cellSets in mesh.cell_sets_dict.items():
       if key == "gmsh:bounding_entities":
-        pass
-      else:
-        for typ in mesh.cell_sets_dict[key]:
-          for idx in mesh.cell_sets_dict[key][typ]:         
-            iNodes = mesh.cells_dict[typ][idx]
-            for nodeID in iNodes:
-              self.addToGroup( key , nodeID )
+        continue
+        
+      if len(cellSets) == 0:
+        continue
+
+      nodeIDs = concatenate( [ mesh.cells_dict[typ][idx].ravel() for typ,idx in cellSets.items() ] )
+
+      if nodeIDs.size > 0:
+        self.groups.setdefault( key , set() ).update( nodeIDs.tolist() )
   
 #-------------------------------------------------------------------------------
 #
@@ -132,10 +184,30 @@ class NodeSet( itemList ):
 
   def addToGroup( self, modelType, ID ):
 
+    self.groupRows.pop( modelType, None )
+
     if modelType not in self.groups:
-      self.groups[modelType] = [int(ID)]
+      self.groups[modelType] = { int(ID) }
+    elif isinstance( self.groups[modelType] , set ):
+      self.groups[modelType].add( int(ID) )
     else:
       self.groups[modelType].append( int(ID) )
+
+#-------------------------------------------------------------------------------
+#
+#-------------------------------------------------------------------------------
+
+  def finalizeGroups( self ):
+
+    '''
+    Converts the node groups to lists. During reading, the groups are
+    collected in sets, which removes duplicate node IDs on the fly.
+    '''
+
+    for name,group in self.groups.items():
+      self.groups[name] = list( group )
+
+    self.groupRows = {}
       
 #-------------------------------------------------------------------------------
 #
@@ -161,41 +233,64 @@ class NodeSet( itemList ):
 #-------------------------------------------------------------------------------
 
   def readNodalCoords( self , fin ):
-    
-    while True:
-      line = fin.readline()  
 
-      if line.replace(" ", "").startswith('</Nodes>'):
-        return
+    # Collect the records of the block first and convert all coordinates
+    # in a single numpy call. Blocks with a varying number of coordinates
+    # or with expressions are converted per value.
+
+    IDs  = []
+    crds = []
+
+    for line in fin:
+      if '<' in line and line.replace(" ", "").startswith('</Nodes>'):
+        break
   
-      line = re.sub(r'\s{2,}',' ',line)
-      a = line.split(';')
-     
-      for a in a[:-1]:
-        b = a.strip().split(' ')
-            
+      for a in line.split(';')[:-1]:
+        b = a.split()
+
+        if len(b) == 0:
+          continue            
         if b[0].startswith("//") or b[0].startswith("#"):
           break
-        if len(b) > 1 and type(eval(b[0])) == int:
-          if self.rank == -1:
-            self.rank = len(b)-1
+        if len(b) > 1 and isInteger( b[0] ):
+          IDs.append ( int(b[0]) )
+          crds.append( b[1:] )
+
+    if len(IDs) == 0:
+      return
 
-          self.add( eval(b[0]), [eval(crd) for crd in b[1:]] ) 
+    if self.rank == -1:
+      self.rank = len(crds[0])
+
+    try:
+      if any( len(crd) != self.rank for crd in crds ):
+        raise ValueError
+      crds = array( list( chain.from_iterable( crds ) ), dtype=float ).reshape( len(IDs) , self.rank ).tolist()
+    except ValueError:
+      crds = [ [toFloat(x) for x in crd] for crd in crds ]
+
+    self.addMany( IDs , crds )
           
 #-------------------------------------------------------------------------------
 #
 #-------------------------------------------------------------------------------
 
   def readNodegroup( self , fin , key ):
+
+    # Tokens that are not integers, such as the braces around the list,
+    # are skipped.
+
+    IDs = []
     
-    while True:
-      line = fin.readline()
-      
-      if line.replace(" " ,"").startswith('</NodeGro'):
-        return
+    for line in fin:
+      if '<' in line and line.replace(" " ,"").startswith('</NodeGro'):
+        break
         
-      a = line.split()
-      
-      for b in a:
-        if getType(b) == int:
-          self.addToGroup( key ,b )
+      for b in line.split():
+        try:
+          IDs.append( int(b) )
+        except ValueError:
+          pass
+
+    if len(IDs) > 0:
+      self.groups.setdefault( key , set() ).update( IDs )
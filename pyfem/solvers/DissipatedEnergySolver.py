@@ -115,8 +115,8 @@ class DissipatedEnergySolver( BaseModule ):
     while error > self.tol:
       stat.iiter += 1
 
-      d1 = globdat.dofs.solve( K , fhat )
-      d2 = globdat.dofs.solve( K , res )
+      d1 = globdat.dofs.solve( K , fhat , reuseFactor = True )
+      d2 = globdat.dofs.solve( K , res  , reuseFactor = True )
             
       ddlamR = -dot(Da1,d2)/dot(Da1,d1)
       ddaR   = ddlamR*d1 + d2
@@ -110,8 +110,8 @@ class RiksSolver( BaseModule ):
 
       stat.iiter += 1
 
-      d1 = globdat.dofs.solve( K , fhat )
-      d2 = globdat.dofs.solve( K , res )
+      d1 = globdat.dofs.solve( K , fhat , reuseFactor = True )
+      d2 = globdat.dofs.solve( K , res  , reuseFactor = True )
        
       ddlam = -dot(Da1,d2)/dot(Da1,d1)
       dda   = ddlam*d1 + d2
@@ -168,11 +168,11 @@ class GlobalData ( Properties ):
     while True:
       line = fin.readline()  
   
-      if line.startswith('<ExternalForces>') == True:
+      if line.startswith('<ExternalForces>'):
         while True:
           line = fin.readline()  
 
-          if line.startswith('</ExternalForces>') == True:
+          if line.startswith('</ExternalForces>'):
             return
         
           a = line.strip().split(';')
@@ -28,12 +28,19 @@
 #  event caused by the use of the program.                                     #
 ################################################################################
 
+from numpy import ndarray
+
 class itemList ( dict ):
 
     """
     Class to construct a list of items that have a coninuous local number, and
     a global ID.
     """
+
+    def __init__ ( self, *args, **kwargs ):
+
+        dict.__init__( self, *args, **kwargs )
+        self.indexMap = None
   
     def add ( self, ID: int, item ):
     
@@ -49,6 +56,32 @@ class itemList ( dict ):
             raise RuntimeError( 'ID ' + str(ID) + ' already exists in ' + type(self).__name__ )
 
         self[ID] = item
+        self.indexMap = None
+
+    def addMany ( self, IDs, items ):
+    
+        """
+        Adds a series of items with their IDs to the list in a single update.
+    
+        Args:
+            IDs (list[int]|ndarray): the IDs of the items to be stored.
+            items: the values of the items to be stored, in the same order.
+        """
+
+        if isinstance(IDs,ndarray):
+            IDs = IDs.tolist()
+
+        newItems = dict( zip( IDs , items ) )
+
+        if len(newItems) < len(IDs) or not self.keys().isdisjoint( newItems ):
+            seen = set( self.keys() )
+            for ID in IDs:
+                if ID in seen:
+                    raise RuntimeError( 'ID ' + str(ID) + ' already exists in ' + type(self).__name__ )
+                seen.add( ID )
+
+        self.update( newItems )
+        self.indexMap = None
 
     def get ( self, IDs ):
 
@@ -56,21 +89,25 @@ class itemList ( dict ):
         Returns the index / indices of an ID or list of IDs of items in the list.
     
         Args:
-            IDs (list[int]|int,optional): the ID/IDs. If ommited, a list with all indces
+            IDs (list[int]|ndarray|int,optional): the ID/IDs. If ommited, a list with all indces
             will be returned.
         Returns:
             list[int]: a list with the indices. In the case of a single ID, this list has
-            length 1.
+            length 1. An ndarray of IDs is treated as a flat list of IDs.
         """
         
         if isinstance(IDs,int):
             return self[IDs]
         elif isinstance(IDs,list):
             return [ self[ID] for ID in IDs ]
+        elif isinstance(IDs,ndarray):
+            if IDs.ndim == 0:
+                return self[IDs.item()]
+            return [ self[ID] for ID in IDs.ravel().tolist() ]
       
         raise RuntimeError('illegal argument for itemList.get')
     
-    def getIndices ( self, IDs : list[int] | int = -1 ) -> list[int]:
+    def getIndices ( self, IDs : list[int] | ndarray | int = -1 ) -> list[int]:
         
         """
         Returns the index / indices of an ID or list of IDs of items in the list.
@@ -83,14 +120,36 @@ class itemList ( dict ):
             length 1.
         """
         
+        if isinstance(IDs,ndarray):
+            IDs = IDs.tolist()
+
         if IDs == -1:
             return list(self.keys())
         elif isinstance(IDs,int):
-            return list(self.keys()).index( IDs )
+            return self.getIndexMap()[IDs]
         elif isinstance(IDs,list):
-            return [ list(self.keys()).index( ID ) for ID in IDs ]
+            index = self.getIndexMap()
+            return [ index[ID] for ID in IDs ]
       
         raise RuntimeError('illegal argument for itemList.getIndices')  
+
+    def getIndexMap ( self ) -> dict:
+
+        """
+        Returns a dict with the index of each ID in the list. The dict is built
+        on the first call and reused until items are added.
+
+        Returns:
+            dict: the index of each ID.
+        """
+
+        indexMap = getattr( self, 'indexMap', None )
+
+        if indexMap is None or len(indexMap) != len(self):
+            indexMap = { ID : i for i,ID in enumerate( self.keys() ) }
+            self.indexMap = indexMap
+
+        return indexMap
     
     def findID( self , index : int ) -> int:
   